@@ -4,15 +4,21 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
 
+from bulk_load import get_engine
+from cohort import cohort_payload, spend_weight_clusters
+from index_methods import INDEX_METHODS, read_index
+
 '''
  - Lets you select a random user and view their personal CPI
  - compares personal cpi against official CPI from BLS
  - shows how user category spending weights evolve over time
  - plots model based personal CPI forecasts with confidence intervals
  - includes a what-if scenario tool that shocks inflation in a selected category
+ - personal CPI can be shown as fixed Laspeyres, chained Laspeyres or Törnqvist (index_methods.py)
+ - cohort view: overlays many users' personal CPI (e.g. a spend-weight cluster) against CPI-U,
+   downsampled server-side and drawn with WebGL (Scattergl)
 
 '''
 
@@ -22,7 +28,7 @@ DB_URL = os.getenv("DB_URL")
 if not DB_URL:
     raise SystemExit("❌ DB_URL is not set in .env")
 
-engine = create_engine(DB_URL)
+engine = get_engine(DB_URL)  # WAL: reads don't block on pipeline writes
 
 
 @st.cache_data
@@ -48,6 +54,100 @@ def get_user_mapping():
     mapping = {cc: i for i, cc in enumerate(cc_list)}
     return mapping
 
+@st.cache_data
+def load_index(method):
+    # personal CPI (cc_num, month, personal_cpi) for one index method
+    if method == "fixed_laspeyres":
+        return load_tables()[0]
+    df = read_index(engine, method)
+    df["month"] = pd.to_datetime(df["month"])
+    return df
+
+
+@st.cache_data
+def load_clusters():
+    _, _, monthly_weights, _, _ = load_tables()
+    return spend_weight_clusters(monthly_weights)
+
+
+@st.cache_data
+def load_cohort(cluster, max_users, method):
+    # Cached per (cluster, max_users, method): the downsampled payload is what gets sent to the browser
+    personal_index = load_index(method)
+    clusters = load_clusters()
+
+    if cluster == "All users":
+        cc_nums = clusters["cc_num"].to_numpy()
+    else:
+        cc_nums = clusters.loc[clusters["cluster"] == cluster, "cc_num"].to_numpy()
+
+    return cohort_payload(personal_index, cc_nums, max_users=max_users)
+
+
+def cohort_page(cpi_norm, method):
+    st.subheader("Cohort: Personal CPI of many users vs Official CPI (CPI-U)")
+
+    clusters = load_clusters()
+    st.sidebar.markdown("### 👥 Cohort")
+    cluster = st.sidebar.selectbox(
+        "Spend-weight cluster", ["All users"] + sorted(clusters["cluster"].unique())
+    )
+    max_users = st.sidebar.slider("Max users overlaid", 100, 5000, 1000, step=100)
+
+    payload = load_cohort(cluster, max_users, method)
+    if payload["n_users"] == 0:
+        st.info("No users in this cohort.")
+        return
+
+    median = payload["median"]
+    cpi_head = cpi_norm[cpi_norm["category"] == "Other"].sort_values("month")
+    cpi_head = cpi_head[
+        (cpi_head["month"] >= median["month"].min()) & (cpi_head["month"] <= median["month"].max())
+    ]
+
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scattergl(
+            x=payload["x"],
+            y=payload["y"],
+            mode="lines",
+            line=dict(width=1, color="rgba(100,100,200,0.15)"),
+            name=f"Users ({payload['n_users']})",
+            hoverinfo="skip",
+        )
+    )
+    fig.add_trace(
+        go.Scattergl(
+            x=median["month"],
+            y=median["personal_cpi"],
+            mode="lines",
+            line=dict(width=3),
+            name="Cohort median",
+        )
+    )
+    fig.add_trace(
+        go.Scattergl(
+            x=cpi_head["month"],
+            y=cpi_head["cpi_index"],
+            mode="lines",
+            line=dict(width=3, dash="dash"),
+            name="CPI-U (Official)",
+        )
+    )
+    fig.update_layout(
+        xaxis_title="Month",
+        yaxis_title="Index (base=100)",
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1,
+        ),
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+
 def main():
     st.set_page_config(
         page_title="Personal CPI Tracker",
@@ -61,6 +161,23 @@ def main():
 
     personal_index, cpi_norm, monthly_weights, forecast, transactions = load_tables()
 
+    st.sidebar.markdown("### 📐 Index method")
+    method = st.sidebar.selectbox(
+        "Personal CPI method", list(INDEX_METHODS), format_func=INDEX_METHODS.get
+    )
+    index_df = load_index(method)
+    if index_df.empty:
+        st.sidebar.warning(
+            "No data for this method yet, run `python src/index_methods.py`. Showing fixed Laspeyres."
+        )
+        method = "fixed_laspeyres"
+        index_df = personal_index
+
+    view = st.sidebar.radio("View", ["Single user", "Cohort overlay"])
+    if view == "Cohort overlay":
+        cohort_page(cpi_norm, method)
+        return
+
     #  user selection random button
     cc_nums = sorted(personal_index["cc_num"].unique())
 
@@ -76,9 +193,11 @@ def main():
     st.sidebar.write(f"Current cc_num: `{selected_cc}`")
 
     # Filter per-user data
-    pi = personal_index[personal_index["cc_num"] == selected_cc].sort_values("month")
+    pi = index_df[index_df["cc_num"] == selected_cc].sort_values("month")
     mw = monthly_weights[monthly_weights["cc_num"] == selected_cc].sort_values("month")
     fc = forecast[forecast["cc_num"] == selected_cc].sort_values("month")
+    if "method" in fc.columns:
+        fc = fc[fc["method"] == method]
     tx = transactions[transactions["cc_num"] == selected_cc].sort_values("date")
 
     # scenario controls
@@ -244,7 +363,10 @@ def main():
             )
             st.plotly_chart(fig_fc, use_container_width=True)
         else:
-            st.info("No forecast data available for this user yet.")
+            st.info(
+                "No forecast data available for this user yet "
+                f"(forecasts are per method: `python src/forecast.py --method {method}`)."
+            )
 
     #  4) Scenario impact
     with st.container():
@@ -1,7 +1,8 @@
 import os, requests, pandas as pd
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
 
+from bulk_load import bulk_write, get_engine
+
 
 '''
 - pulls official CPI time-series data from BLS API
@@ -11,7 +12,7 @@ from dotenv import load_dotenv
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL")
-engine = create_engine(DB_URL, connect_args={"timeout": 30})
+engine = get_engine(DB_URL)
 
 BLS_URL = "https://api.bls.gov/publicAPI/v2/timeseries/data/"
 
@@ -66,7 +67,7 @@ def fetch_cpi(series_ids=SERIES, start=2018, end=2030):
     df["month"] = pd.to_datetime(df["month"])
     df = df.sort_values("month")
     
-    df.to_sql('cpi_series', engine, if_exists='replace', index=False)
+    bulk_write(df, 'cpi_series', engine)
     print("Stored CPI in Table cpi_series")
 
 
@@ -0,0 +1,185 @@
+import io
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine, event, inspect
+
+'''
+Shared write layer used by every script that stores a table
+- SQLite: WAL journal + tuned PRAGMAs so readers (Streamlit) aren't blocked while writing,
+  rows loaded with executemany in large batches inside one transaction
+- Postgres: rows streamed with COPY; replacing a table with the same columns is done with
+  TRUNCATE + INSERT ... SELECT so views over it (cpi_norm, monthly_weights, ...) stay valid
+- every load goes into a staging table that is swapped in (or appended, or merged by key)
+  atomically, so readers see either the old table or the new one, never a half-written one
+- reports rows/s so backends can be compared
+'''
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",  # ~64MB page cache
+)
+
+BATCH_SIZE = 50_000
+
+
+def get_engine(db_url):
+    # SQLite gets a lock timeout + PRAGMAs on every connection, other backends use defaults
+    if db_url.startswith("sqlite"):
+        engine = create_engine(db_url, connect_args={"timeout": 30})
+
+        @event.listens_for(engine, "connect")
+        def _set_pragmas(dbapi_conn, _):
+            cur = dbapi_conn.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cur.execute(pragma)
+            cur.close()
+
+        return engine
+
+    return create_engine(db_url)
+
+
+def _rows(df):
+    # DataFrame -> list of plain Python tuples, datetimes as SQLite-style strings, NaN/NaT -> None
+    out = df.copy()
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+    out = out.astype(object).where(out.notna(), None)
+    return list(out.itertuples(index=False, name=None))
+
+
+def _publish_sql(engine, df, table, staging, mode, keys=None):
+    """
+    Statements that move staging into `table`: INSERT ... SELECT for append,
+    rename-swap for replace, TRUNCATE + INSERT ... SELECT for refill.
+    replace_keys first deletes the rows whose `keys` values appear in staging.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    cols = ", ".join(quote(c) for c in df.columns)
+    create = pd.io.sql.get_schema(df, table, con=engine)
+    insert = [
+        create.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1),
+        f"INSERT INTO {quote(table)} ({cols}) SELECT {cols} FROM {quote(staging)}",
+        f"DROP TABLE {quote(staging)}",
+    ]
+    if mode == "append":
+        return insert
+    if mode == "replace_keys":
+        key_cols = ", ".join(quote(k) for k in keys)
+        delete = (
+            f"DELETE FROM {quote(table)} WHERE ({key_cols}) IN "
+            f"(SELECT DISTINCT {key_cols} FROM {quote(staging)})"
+        )
+        return insert[:1] + [delete] + insert[1:]
+    if mode == "refill":
+        return insert[:1] + [f"TRUNCATE TABLE {quote(table)}"] + insert[1:]
+    return [
+        f"DROP TABLE IF EXISTS {quote(table)}",
+        f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}",
+    ]
+
+
+def _load_sqlite(engine, df, table, staging, batch_size, mode, keys):
+    quote = engine.dialect.identifier_preparer.quote
+    cols = ", ".join(quote(c) for c in df.columns)
+    marks = ", ".join("?" for _ in df.columns)
+    insert_sql = f"INSERT INTO {quote(staging)} ({cols}) VALUES ({marks})"
+
+    raw = engine.raw_connection()
+    dbapi_conn = getattr(raw, "driver_connection", None) or raw.connection
+    old_isolation = dbapi_conn.isolation_level
+    # Manage the transaction ourselves so the DDL swap is part of it
+    dbapi_conn.isolation_level = None
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(f"DROP TABLE IF EXISTS {quote(staging)}")
+        cur.execute(pd.io.sql.get_schema(df, staging, con=engine))
+        # Box rows one batch at a time so peak memory is bounded by batch_size
+        for i in range(0, len(df), batch_size):
+            cur.executemany(insert_sql, _rows(df.iloc[i:i + batch_size]))
+
+        # legacy rename: views that reference `table` (cpi_norm, monthly_weights, ...) aren't re-checked
+        cur.execute("PRAGMA legacy_alter_table=ON")
+        for sql in _publish_sql(engine, df, table, staging, mode, keys):
+            cur.execute(sql)
+        cur.execute("COMMIT")
+    except Exception:
+        if dbapi_conn.in_transaction:
+            cur.execute("ROLLBACK")
+        raise
+    finally:
+        # Pooled connection goes back with default rename semantics and isolation
+        cur.execute("PRAGMA legacy_alter_table=OFF")
+        cur.close()
+        dbapi_conn.isolation_level = old_isolation
+        raw.close()
+
+
+def _load_postgres(engine, df, table, staging, mode, keys):
+    quote = engine.dialect.identifier_preparer.quote
+    cols = ", ".join(quote(c) for c in df.columns)
+    copy_sql = f"COPY {quote(staging)} ({cols}) FROM STDIN WITH (FORMAT csv)"
+
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote(staging)}")
+        conn.exec_driver_sql(pd.io.sql.get_schema(df, staging, con=engine))
+
+        cur = conn.connection.cursor()
+        if hasattr(cur, "copy_expert"):  # psycopg2
+            cur.copy_expert(copy_sql, buf)
+        else:  # psycopg 3
+            with cur.copy(copy_sql) as copy:
+                copy.write(buf.read())
+        cur.close()
+
+        for sql in _publish_sql(engine, df, table, staging, mode, keys):
+            conn.exec_driver_sql(sql)
+
+
+def _load_generic(engine, df, table, staging, batch_size, mode, keys):
+    with engine.begin() as conn:
+        df.to_sql(staging, conn, if_exists="replace", index=False, chunksize=batch_size, method="multi")
+        for sql in _publish_sql(engine, df, table, staging, mode, keys):
+            conn.exec_driver_sql(sql)
+
+
+def bulk_write(df, table, engine, batch_size=BATCH_SIZE, mode="replace", keys=None):
+    """
+    Replace `table` with the contents of `df`, add them to it (mode="append"), or
+    replace only the rows sharing `keys` values with `df` (mode="replace_keys").
+    Rows are loaded into `<table>__staging` and published within one transaction.
+    Returns rows/s and prints a one-line timing report.
+    """
+    staging = f"{table}__staging"
+    dialect = engine.dialect.name
+
+    insp = inspect(engine)
+    existing = {c["name"] for c in insp.get_columns(table)} if insp.has_table(table) else None
+    if mode == "replace_keys" and existing is not None and not set(keys) <= existing:
+        # A table written before the key columns existed can't be merged by key
+        mode = "replace"
+    if mode == "replace" and dialect == "postgresql" and existing == set(df.columns):
+        # Postgres won't drop a table that views depend on: keep it and refill it instead
+        mode = "refill"
+
+    start = time.perf_counter()
+    if dialect == "sqlite":
+        _load_sqlite(engine, df, table, staging, batch_size, mode, keys)
+    elif dialect == "postgresql":
+        _load_postgres(engine, df, table, staging, mode, keys)
+    else:
+        _load_generic(engine, df, table, staging, batch_size, mode, keys)
+    elapsed = time.perf_counter() - start
+
+    rate = len(df) / elapsed if elapsed > 0 else float("inf")
+    print(f" Wrote {len(df):,} rows to {table} on {dialect} in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+    return rate
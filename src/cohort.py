@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+
+'''
+Cohort helpers shared by the dashboard and the static charts
+- groups users into spend-weight clusters (KMeans on each user's average category weights)
+- downsamples each user's personal CPI line server-side with LTTB
+- packs a whole cohort into one gap-separated line so it renders as a single WebGL trace
+'''
+
+N_CLUSTERS = 5
+N_POINTS = 60  # points kept per user line after downsampling
+MAX_USERS = 5000  # larger cohorts are sampled down to this many lines
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first/last point and, per bucket, the point forming the largest
+    triangle with the previously kept point and the next bucket's average.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    every = (n - 2) / (n_out - 2)
+    keep = [0]
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        keep.append(a)
+    keep.append(n - 1)
+
+    return x[keep], y[keep]
+
+
+def spend_weight_clusters(monthly_weights, n_clusters=N_CLUSTERS):
+    # cc_num -> cluster, from each user's average monthly weight per CPI category
+    w = (
+        monthly_weights.groupby(["cc_num", "month", "category"])["weight"].sum()
+        .groupby(["cc_num", "category"]).mean()
+        .unstack(fill_value=0.0)
+    )
+    k = min(n_clusters, len(w))
+    labels = KMeans(n_clusters=k, n_init=10, random_state=0).fit_predict(w.to_numpy())
+    return pd.DataFrame({"cc_num": w.index, "cluster": labels})
+
+
+def sample_cohort(cc_nums, max_users=MAX_USERS):
+    # Seeded sample so the dashboard and the static charts draw the same users
+    cc_nums = np.sort(np.asarray(cc_nums))
+    if len(cc_nums) > max_users:
+        cc_nums = np.random.default_rng(0).choice(cc_nums, size=max_users, replace=False)
+    return cc_nums
+
+
+def cohort_payload(personal_index, cc_nums, n_points=N_POINTS, max_users=MAX_USERS):
+    """
+    Downsampled personal CPI lines for (a seeded sample of at most `max_users` of)
+    the users in `cc_nums`, concatenated into single x/y arrays with NaT/NaN
+    separators (one trace instead of one per user), plus the sample's
+    full-resolution median line.
+    """
+    cc_nums = sample_cohort(cc_nums, max_users)
+    pi = personal_index[personal_index["cc_num"].isin(cc_nums)].sort_values(["cc_num", "month"])
+
+    xs, ys = [], []
+    for _, grp in pi.groupby("cc_num"):
+        x = grp["month"].to_numpy(dtype="datetime64[ns]").astype("int64")
+        y = grp["personal_cpi"].to_numpy(dtype=float)
+        x, y = lttb(x, y, n_points)
+        xs.extend([x, [np.iinfo("int64").min]])  # int64 min -> NaT
+        ys.extend([y, [np.nan]])
+
+    if xs:
+        x = np.concatenate(xs).astype("datetime64[ns]")
+        y = np.concatenate(ys)
+    else:
+        x, y = np.array([], dtype="datetime64[ns]"), np.array([])
+
+    median = pi.groupby("month", as_index=False)["personal_cpi"].median()
+
+    return {
+        "x": x,
+        "y": y,
+        "n_users": pi["cc_num"].nunique(),
+        "median": median,
+    }
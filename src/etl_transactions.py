@@ -1,8 +1,9 @@
 import os, re
 import pandas as pd
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
 
+from bulk_load import bulk_write, get_engine
+
 '''
 ETL Script
 - Performs the ingestion and cleaning stage of the pipleline.
@@ -14,7 +15,7 @@ ETL Script
 
 load_dotenv()
 
-engine = create_engine(os.getenv("DB_URL"))
+engine = get_engine(os.getenv("DB_URL"))
 
 
 def load_and_store(csv_path: str):
@@ -28,7 +29,7 @@ def load_and_store(csv_path: str):
 
     df = df.dropna(subset=['date', 'amt'])
 
-    df[['date', 'cc_num', 'category', 'amt']].to_sql('transactions_raw', engine, if_exists='replace', index=False)
+    bulk_write(df[['date', 'cc_num', 'category', 'amt']], 'transactions_raw', engine)
 
     print("Loaded SQL table transactions_raw")
 
@@ -1,14 +1,26 @@
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import inspect, text
 from dotenv import load_dotenv
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 
+from bulk_load import bulk_write, get_engine
+from index_methods import read_index
+
 '''
 
 Reads each user's personalized CPI time series
 - fits a SARIMAX time-series model per user, generates multi-step ahead forcasts w/ confidence interval
 - short or problematic history, falls back to naive flat forecast using last observed
+- any index method from index_methods.py can be forecast (fixed Laspeyres by default)
+- backtest mode: rolling-origin cross-validation over a grid of candidate models per user,
+  run across a process pool. Picks the best model per cc_num and writes an accuracy/time report
+  (series and folds prepared once per user; each candidate differences inside its own SARIMAX fit)
 
 '''
 
@@ -18,40 +30,228 @@ load_dotenv()
 DB_URL = os.getenv("DB_URL")
 if not DB_URL:
     raise SystemExit("DB_URL is not set in .env")
-engine = create_engine(DB_URL, connect_args={"timeout": 30})
+engine = get_engine(DB_URL)
+
+
+# Candidate models: name -> (order, seasonal_order). None = naive flat forecast.
+DEFAULT_MODEL = "sarima_111_011"
+CANDIDATE_MODELS = {
+    "sarima_111_011": ((1, 1, 1), (0, 1, 1, 12)),
+    "sarima_011_011": ((0, 1, 1), (0, 1, 1, 12)),
+    "arima_111": ((1, 1, 1), (0, 0, 0, 0)),
+    "arima_011": ((0, 1, 1), (0, 0, 0, 0)),
+    "arima_110": ((1, 1, 0), (0, 0, 0, 0)),
+    "naive": None,
+}
+
+MIN_POINTS = 6  # fewer points than this -> naive forecast
+
+
+def prepare_series(grp):
+    # One user's personal CPI as a monthly (Month Start) series, gaps forward-filled.
+    s = grp.set_index("month")["personal_cpi"].sort_index()
+    s = s.asfreq("MS")
+    return s.ffill()
+
+
+def _fit_sarimax(y, order, seasonal_order):
+    # Same estimator for backtest folds and the stored forecast
+    return SARIMAX(
+        y,
+        order=order,
+        seasonal_order=seasonal_order,
+        enforce_stationarity=False,
+        enforce_invertibility=False,
+    ).fit(disp=False)
+
+
+def _diff_lags(spec):
+    # Observations consumed by differencing: d + D * m
+    (_, d, _), (_, D, _, m) = spec
+    return d + D * m
+
+
+def rolling_origin_splits(n, horizon=3, n_folds=4, min_train=MIN_POINTS):
+    # (origin, end) pairs: train on y[:origin], test on y[origin:end].
+    splits = []
+    for i in range(n_folds):
+        origin = n - horizon - (n_folds - 1 - i)
+        if origin >= min_train:
+            splits.append((origin, min(origin + horizon, n)))
+    return splits
 
 
-def forecast_all_users(steps=12):
+def backtest_user(args):
     """
-    For each user (cc_num) in personal_index, fit a simple SARIMA model
-    and forecast the next `steps` months of personal CPI.
-    Results are stored in the `personal_forecast` table.
+    Evaluate every candidate model on one user's series with rolling-origin CV.
+    The folds are built once and shared by all candidates: every training window
+    keeps MIN_POINTS observations after the heaviest differencing in the grid.
+    Differencing is not shared: each fit runs the same integrated SARIMAX as
+    forecast_all_users, whose level confidence bands need the undifferenced model.
+    A failed fit is scored with the naive fallback production would store and
+    counted in `failed_folds`. Runs inside a worker process.
     """
-    # 1) Read historical personal CPI
-    df = pd.read_sql(
-        "SELECT cc_num, month, personal_cpi FROM personal_index ORDER BY cc_num, month",
-        engine,
+    cc_num, s, horizon, n_folds = args
+    y = s.to_numpy(dtype=float)
+
+    max_lags = max(_diff_lags(spec) for spec in CANDIDATE_MODELS.values() if spec is not None)
+    splits = rolling_origin_splits(len(y), horizon, n_folds, MIN_POINTS + max_lags)
+
+    rows = []
+    for name, spec in CANDIDATE_MODELS.items():
+        errors = []
+        failed = 0
+        start = time.perf_counter()
+
+        for origin, end in splits:
+            actual = y[origin:end]
+            naive = np.repeat(y[origin - 1], len(actual))
+
+            if spec is None:
+                pred = naive
+            else:
+                try:
+                    pred = np.asarray(_fit_sarimax(y[:origin], *spec).forecast(len(actual)))
+                    if not np.isfinite(pred).all():
+                        raise ValueError("non-finite forecast")
+                except Exception:
+                    failed += 1
+                    pred = naive
+
+            errors.append(pred - actual)
+
+        elapsed = time.perf_counter() - start
+        if errors:
+            err = np.concatenate(errors)
+            mae = float(np.mean(np.abs(err)))
+            rmse = float(np.sqrt(np.mean(err ** 2)))
+        else:
+            mae = rmse = np.nan
+
+        rows.append(
+            {
+                "cc_num": cc_num,
+                "model": name,
+                "folds": len(errors),
+                "failed_folds": failed,
+                "mae": mae,
+                "rmse": rmse,
+                "fit_seconds": elapsed,
+            }
+        )
+
+    return rows
+
+
+def backtest_all_users(horizon=3, n_folds=4, max_workers=None, tolerance=0.05, method="fixed_laspeyres"):
+    """
+    Rolling-origin backtest of CANDIDATE_MODELS for every user, fanned out over a
+    process pool. Writes the per-user report to `forecast_backtest` and the chosen
+    model per cc_num (lowest MAE) to `forecast_model`, replacing only the rows
+    of this index `method`.
+    """
+    df = read_index(engine, method)
+
+    if df.empty:
+        print(f"No {method} index yet. Run the CPI + SQL steps (and index_methods.py) first.")
+        return
+
+    df["month"] = pd.to_datetime(df["month"])
+
+    # Prepare each user's series once; workers receive the ready-to-use series
+    tasks = [
+        (cc_num, prepare_series(grp), horizon, n_folds)
+        for cc_num, grp in df.groupby("cc_num")
+    ]
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for user_rows in pool.map(backtest_user, tasks, chunksize=8):
+            rows.extend(user_rows)
+
+    report = pd.DataFrame(rows)
+    scored = report.dropna(subset=["mae"])
+    if scored.empty:
+        print("Not enough history to backtest any user.")
+        return
+
+    # Only models scored on all of the user's folds without a failed fit compete;
+    # best is the lowest MAE, ties go to the cheaper fit
+    eligible = scored[
+        (scored["folds"] == scored.groupby("cc_num")["folds"].transform("max"))
+        & (scored["failed_folds"] == 0)
+    ]
+    best = (
+        eligible.sort_values(["cc_num", "mae", "fit_seconds"])
+        .groupby("cc_num", as_index=False)
+        .first()[["cc_num", "model", "mae"]]
+    )
+    report = report.merge(
+        best.rename(columns={"model": "best_model", "mae": "best_mae"}),
+        on="cc_num",
+        how="left",
+    )
+    report["within_tol"] = report["mae"] <= report["best_mae"] * (1 + tolerance)
+    report["method"] = method
+
+    best["method"] = method
+
+    bulk_write(report, "forecast_backtest", engine, mode="replace_keys", keys=["method"])
+    bulk_write(best[["cc_num", "method", "model"]], "forecast_model", engine, mode="replace_keys", keys=["method"])
+
+    # Which models are good enough, and at what cost
+    summary = report.groupby("model").agg(
+        mean_mae=("mae", "mean"),
+        mean_rmse=("rmse", "mean"),
+        mean_fit_seconds=("fit_seconds", "mean"),
+        failed_folds=("failed_folds", "sum"),
+        good_enough=("within_tol", "mean"),
     )
+    summary["chosen"] = best["model"].value_counts().reindex(summary.index).fillna(0).astype(int)
+    print(summary.sort_values("mean_fit_seconds").to_string())
+    print("Wrote forecast_backtest and forecast_model tables")
+
+
+def forecast_all_users(steps=12, use_selected=False, method="fixed_laspeyres"):
+    """
+    For each user (cc_num), fit a simple SARIMA model to their personal CPI
+    (index `method`, see index_methods.INDEX_METHODS) and forecast the next `steps` months.
+    With `use_selected`, each user's model comes from the `forecast_model`
+    rows for this `method` written by backtest_all_users (default model for unknown users).
+    Results replace this method's rows in the `personal_forecast` table.
+    """
+    # 1) Read historical personal CPI
+    df = read_index(engine, method)
 
     if df.empty:
-        print("personal_index is empty. Run the CPI + SQL steps first.")
+        print(f"No {method} index yet. Run the CPI + SQL steps (and index_methods.py) first.")
         return
 
     # Ensure proper datetime
     df["month"] = pd.to_datetime(df["month"])
 
+    selected = {}
+    if use_selected:
+        sel = pd.DataFrame(columns=["cc_num", "model"])
+        if inspect(engine).has_table("forecast_model"):
+            sel = pd.read_sql(
+                text("SELECT cc_num, model FROM forecast_model WHERE method = :method"),
+                engine,
+                params={"method": method},
+            )
+        if sel.empty:
+            print(f"No models selected for {method}, using {DEFAULT_MODEL} for everyone")
+        selected = dict(zip(sel["cc_num"], sel["model"]))
+
     all_forecasts = []
 
     # 2) Loop over each user
     for cc_num, grp in df.groupby("cc_num"):
-        s = grp.set_index("month")["personal_cpi"].sort_index()
-
-        # Force to monthly frequency (Month Start)
-        s = s.asfreq("MS")
-        s = s.ffill()  
+        s = prepare_series(grp)
 
         last_date = s.index.max()
         last_value = s.iloc[-1]
+        model_name = selected.get(cc_num, DEFAULT_MODEL)
 
         # naive flat forecast (used for short/failed series)
         def naive_forecast():
@@ -70,26 +270,26 @@ def forecast_all_users(steps=12):
                     "forecast": last_value,
                     "lower": last_value,
                     "upper": last_value,
+                    "model": "naive",
                 }
             )
 
         # If too few points -> skip SARIMAX, just use naive
-        if len(s) < 6:
+        if len(s) < MIN_POINTS:
             print(f" Not enough data for cc_num={cc_num}, using naive forecast.")
             fc_df = naive_forecast()
             all_forecasts.append(fc_df)
             continue
 
+        spec = CANDIDATE_MODELS.get(model_name, CANDIDATE_MODELS[DEFAULT_MODEL])
+        if spec is None:
+            all_forecasts.append(naive_forecast())
+            continue
+        order, seasonal_order = spec
+
         try:
             # Try SARIMAX
-            model = SARIMAX(
-                s,
-                order=(1, 1, 1),
-                seasonal_order=(0, 1, 1, 12),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
-            )
-            res = model.fit(disp=False)
+            res = _fit_sarimax(s, order, seasonal_order)
 
             fc = res.get_forecast(steps=steps)
             fc_df = fc.summary_frame()[["mean", "mean_ci_lower", "mean_ci_upper"]]
@@ -100,6 +300,7 @@ def forecast_all_users(steps=12):
                 fc_df.rename(columns={"index": "month"}, inplace=True)
 
             fc_df["cc_num"] = cc_num
+            fc_df["model"] = model_name
             fc_df.rename(
                 columns={
                     "mean": "forecast",
@@ -110,7 +311,7 @@ def forecast_all_users(steps=12):
             )
 
             all_forecasts.append(fc_df)
-            print(f" Forecasted {steps} months for cc_num={cc_num}")
+            print(f" Forecasted {steps} months for cc_num={cc_num} ({model_name})")
 
         except Exception as e:
             print(f" Error forecasting cc_num={cc_num}, falling back to naive: {e}")
@@ -126,10 +327,18 @@ def forecast_all_users(steps=12):
 
     # Make sure month is datetime
     out["month"] = pd.to_datetime(out["month"])
+    out["method"] = method
 
-    out.to_sql("personal_forecast", engine, if_exists="replace", index=False)
-    print("Wrote personal_forecast table to SQLite")
+    bulk_write(out, "personal_forecast", engine, mode="replace_keys", keys=["method"])
+    print(f"Wrote {method} forecasts to personal_forecast")
 
 
 if __name__ == "__main__":
-    forecast_all_users(steps=12)
+    # python src/forecast.py --backtest  -> pick models per user, then forecast with them
+    # python src/forecast.py --method chained_laspeyres  -> forecast another index method
+    method = sys.argv[sys.argv.index("--method") + 1] if "--method" in sys.argv else "fixed_laspeyres"
+    if "--backtest" in sys.argv:
+        backtest_all_users(horizon=3, n_folds=4, method=method)
+        forecast_all_users(steps=12, use_selected=True, method=method)
+    else:
+        forecast_all_users(steps=12, method=method)
@@ -0,0 +1,244 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+from dotenv import load_dotenv
+
+from bulk_load import bulk_write, get_engine
+
+'''
+Alternative personal CPI index methods, stored next to the fixed-weight personal_index view
+- chained Laspeyres: weights re-based every January on the previous year's average spending,
+  linked through December of the previous year
+- Törnqvist: monthly log-links weighted by the average of consecutive rolling 12-month weights
+- computed on a users x months x categories array, one month at a time for all users at once
+- incremental: months already in personal_index_methods are reused as the chain's seed,
+  so a new month only costs its own link
+'''
+
+METHODS_TABLE = "personal_index_methods"
+
+INDEX_METHODS = {
+    "fixed_laspeyres": "Fixed Laspeyres (base-month weights)",
+    "chained_laspeyres": "Chained Laspeyres (annual re-weighting)",
+    "tornqvist_12m": "Törnqvist (rolling 12-month weights)",
+}
+
+
+def read_index(engine, method="fixed_laspeyres"):
+    # cc_num, month, personal_cpi for one index method (empty if it hasn't been computed yet)
+    if method == "fixed_laspeyres":
+        return pd.read_sql(
+            "SELECT cc_num, month, personal_cpi FROM personal_index ORDER BY cc_num, month",
+            engine,
+        )
+    if not inspect(engine).has_table(METHODS_TABLE):
+        return pd.DataFrame(columns=["cc_num", "month", "personal_cpi"])
+    return pd.read_sql(
+        text(
+            f"SELECT cc_num, month, personal_cpi FROM {METHODS_TABLE} "
+            "WHERE method = :method ORDER BY cc_num, month"
+        ),
+        engine,
+        params={"method": method},
+    )
+
+
+def load_panels(engine):
+    """
+    W[u, t, c]: user's spend weight per CPI category and month (NaN = no spend that month)
+    P[t, c]: normalized CPI per month and category
+    """
+    w = pd.read_sql("SELECT cc_num, month, category, weight FROM monthly_weights", engine)
+    cpi = pd.read_sql("SELECT category, ym, cpi_index FROM cpi_norm", engine)
+
+    w = w.groupby(["cc_num", "month", "category"], as_index=False)["weight"].sum()
+
+    users = pd.Index(np.sort(w["cc_num"].unique()))
+    months = pd.Index(pd.period_range(w["month"].min(), w["month"].max(), freq="M").strftime("%Y-%m"))
+    categories = pd.Index(sorted(cpi["category"].unique()))
+
+    ui = users.get_indexer(w["cc_num"])
+    ti = months.get_indexer(w["month"])
+    ci = categories.get_indexer(w["category"])
+
+    W = np.full((len(users), len(months), len(categories)), np.nan)
+    W[ui, ti, :] = 0.0
+    ok = ci >= 0  # categories without an official CPI series drop out, like the SQL join
+    W[ui[ok], ti[ok], ci[ok]] = w["weight"].to_numpy()[ok]
+
+    P = (
+        cpi.pivot_table(index="ym", columns="category", values="cpi_index")
+        .reindex(index=months, columns=categories)
+        .to_numpy()
+    )
+    return W, P, users, months
+
+
+def _weighted_sum(w, p):
+    # sum_c w * p. NaN when a category the user spends on has no CPI yet, so that month
+    # isn't stored and a later run fills it in, instead of silently dropping its share
+    missing = ((w > 0) & np.isnan(p)).any(axis=-1) | np.isnan(w).all(axis=-1)
+    out = np.nansum(np.where(w > 0, w * p, 0.0), axis=-1)
+    return np.where(missing, np.nan, out)
+
+
+def _active(W):
+    # first/last observed month per user and the [first, last] mask
+    observed = ~np.isnan(W[:, :, 0])
+    T = observed.shape[1]
+    first = observed.argmax(axis=1)
+    last = T - 1 - observed[:, ::-1].argmax(axis=1)
+    t = np.arange(T)
+    active = (t >= first[:, None]) & (t <= last[:, None])
+    return first, active
+
+
+def _todo(seed, active):
+    # months that still need a link, and the earliest of them
+    need = np.isnan(seed) & active
+    cols = np.flatnonzero(need.any(axis=0))
+    return need, (cols[0] if len(cols) else None)
+
+
+def chained_laspeyres(W, P, months, seed):
+    """
+    Chained Laspeyres with annual re-weighting. seed[u, t] holds already computed
+    levels (NaN = compute). The user's first year uses base-month weights (same
+    level as personal_index); each later year links onto the previous December.
+    """
+    U, T, C = W.shape
+    first, active = _active(W)
+    need, t_min = _todo(seed, active)
+    I = seed.copy()
+    if t_min is None:
+        return I
+
+    rows = np.arange(U)
+    w0 = W[rows, first]
+    years = np.array([int(m[:4]) for m in months])
+    first_year = years[first]
+
+    # Link weights per year: previous year's mean observed weights, carried forward through
+    # years without any spend. Cheap array work, no chain involved.
+    link_w = {}
+    prev = w0
+    for y in range(years[0], years[-1] + 1):
+        in_prev = years == y - 1
+        n_obs = (~np.isnan(W[:, in_prev, 0])).sum(axis=1)
+        mean_prev = np.nansum(W[:, in_prev], axis=1) / np.maximum(n_obs, 1)[:, None]
+        prev = np.where((n_obs > 0)[:, None] & (y > first_year)[:, None], mean_prev, prev)
+        link_w[y] = prev
+
+    for t in range(t_min, T):
+        y = years[t]
+        fixed = _weighted_sum(w0, P[t])
+        ref = np.flatnonzero(years == y)[0] - 1  # December of the previous year
+        if ref >= 0:
+            chained = I[:, ref] * _weighted_sum(link_w[y], P[t] / P[ref])
+        else:
+            chained = fixed
+        level = np.where(y == first_year, fixed, chained)
+        I[:, t] = np.where(need[:, t], level, I[:, t])
+
+    return I
+
+
+def tornqvist_12m(W, P, months, seed):
+    """
+    Törnqvist index with rolling 12-month weights:
+    ln(I_t / I_t-1) = sum_c 0.5 * (s_c,t-1 + s_c,t) * ln(P_c,t / P_c,t-1)
+    where s is the mean of the user's observed weights over the trailing 12 months.
+    """
+    U, T, C = W.shape
+    first, active = _active(W)
+    need, t_min = _todo(seed, active)
+    I = seed.copy()
+    if t_min is None:
+        return I
+
+    rows = np.arange(U)
+    w0 = W[rows, first]
+    observed = ~np.isnan(W[:, :, 0])
+
+    # Most recent observed weights, used when a user has no spend in the whole window
+    last_obs = np.maximum.accumulate(np.where(observed, np.arange(T), 0), axis=1)
+
+    S = np.full_like(W, np.nan)
+    for t in range(max(t_min - 1, 0), T):
+        window = W[:, max(0, t - 11):t + 1]
+        n_obs = (~np.isnan(window[:, :, 0])).sum(axis=1)
+        rolling = np.nansum(window, axis=1) / np.maximum(n_obs, 1)[:, None]
+        S[:, t] = np.where((n_obs > 0)[:, None], rolling, W[rows, last_obs[:, t]])
+
+    for t in range(t_min, T):
+        fixed = _weighted_sum(w0, P[t])
+        if t > 0:
+            log_link = _weighted_sum(0.5 * (S[:, t - 1] + S[:, t]), np.log(P[t] / P[t - 1]))
+            linked = I[:, t - 1] * np.exp(log_link)
+        else:
+            linked = fixed
+        level = np.where(t == first, fixed, linked)
+        I[:, t] = np.where(need[:, t], level, I[:, t])
+
+    return I
+
+
+def update_index_methods(engine, full=False):
+    """
+    Compute the chained Laspeyres and Törnqvist indexes for every user and store
+    them in `personal_index_methods` (cc_num, month, method, personal_cpi).
+    Unless `full`, existing rows seed the chains and only missing months are added.
+    """
+    W, P, users, months = load_panels(engine)
+
+    if not full and not inspect(engine).has_table(METHODS_TABLE):
+        print(f"No {METHODS_TABLE} table yet, computing from scratch")
+        full = True
+
+    stored = None
+    if not full:
+        stored = pd.read_sql(f"SELECT cc_num, month, method, personal_cpi FROM {METHODS_TABLE}", engine)
+
+    out = []
+    for method, fn in (("chained_laspeyres", chained_laspeyres), ("tornqvist_12m", tornqvist_12m)):
+        seed = np.full(W.shape[:2], np.nan)
+        if stored is not None:
+            s = stored[stored["method"] == method]
+            ui = users.get_indexer(s["cc_num"])
+            ti = months.get_indexer(s["month"].astype(str).str[:7])
+            ok = (ui >= 0) & (ti >= 0)
+            seed[ui[ok], ti[ok]] = s["personal_cpi"].to_numpy()[ok]
+
+        I = fn(W, P, months, seed)
+        new = np.isnan(seed) & ~np.isnan(I)
+        u, t = np.nonzero(new)
+        out.append(
+            pd.DataFrame(
+                {
+                    "cc_num": users[u],
+                    "month": months[t] + "-01",
+                    "method": method,
+                    "personal_cpi": I[u, t],
+                }
+            )
+        )
+
+    out = pd.concat(out, ignore_index=True)
+    if out.empty:
+        print(f"{METHODS_TABLE} is up to date")
+        return
+
+    bulk_write(out, METHODS_TABLE, engine, mode="replace" if full else "append")
+    print(f"Wrote {len(out)} new index rows to {METHODS_TABLE}")
+
+
+if __name__ == "__main__":
+    # python src/index_methods.py [--full]
+    load_dotenv()
+    DB_URL = os.getenv("DB_URL")
+    if not DB_URL:
+        raise SystemExit("DB_URL is not set in .env")
+    update_index_methods(get_engine(DB_URL), full="--full" in sys.argv)
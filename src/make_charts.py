@@ -1,16 +1,23 @@
 import os
 import random
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.dates import date2num
 from sqlalchemy import create_engine
 from dotenv import load_dotenv
 
+from cohort import MAX_USERS, cohort_payload, spend_weight_clusters
+from index_methods import INDEX_METHODS, read_index
+
 
 '''
 - Connects to the SQL Database, selects a user and generates:
     - Personal CPI vs Official CPI over time
     - User's category spending weights over time
     - A personal CPI forecast plot with confidence intervals
+    - The user's spend-weight cohort overlaid against CPI-U (downsampled lines)
 
 - All plots saved as PNG under 'charts/'. 
 - Used to compare personalized inflation against headline CPI, understand shifts in spending behavior,
@@ -98,20 +105,21 @@ def plot_category_weights(cc_num, user_id):
     plt.close()
 
 
-def plot_forecast(cc_num, user_id):
-    hist = pd.read_sql(
-        f"SELECT month, personal_cpi FROM personal_index WHERE cc_num = ? ORDER BY month",
-        engine,
-        params=(cc_num,),
-    )
+def plot_forecast(cc_num, user_id, method="fixed_laspeyres"):
+    hist = read_index(engine, method)
+    hist = hist[hist["cc_num"] == cc_num][["month", "personal_cpi"]]
     fc = pd.read_sql(
-        f"SELECT month, forecast, lower, upper FROM personal_forecast WHERE cc_num = ? ORDER BY month",
+        f"SELECT * FROM personal_forecast WHERE cc_num = ? ORDER BY month",
         engine,
         params=(cc_num,),
     )
 
-    if fc.empty:
-        print(f"No forecast data for cc_num={user_id}")
+    # personal_forecast holds one set of rows per index method (older tables have no method column)
+    if "method" in fc.columns:
+        fc = fc[fc["method"] == method]
+
+    if fc.empty or hist.empty:
+        print(f"No {method} forecast data for cc_num={user_id}")
         return
 
     hist["month"] = pd.to_datetime(hist["month"])
@@ -135,7 +143,7 @@ def plot_forecast(cc_num, user_id):
     plt.fill_between(fc["month"], fc["lower"], fc["upper"], color="gray", alpha=0.2, label="95% CI")
     plt.axvline(last_hist_date, linestyle=":", alpha=0.7)
 
-    plt.title(f"Personal CPI Forecast (User {user_id})")
+    plt.title(f"Personal CPI Forecast (User {user_id}, {INDEX_METHODS[method]})")
     plt.xlabel("Month")
     plt.ylabel("Index (Base = 100)")
 
@@ -153,6 +161,65 @@ def plot_forecast(cc_num, user_id):
     plt.close()
 
 
+def plot_cohort_overlay(cc_num, user_id, max_users=MAX_USERS):
+    personal = pd.read_sql(
+        "SELECT cc_num, month, personal_cpi FROM personal_index ORDER BY cc_num, month",
+        engine,
+    )
+    weights = pd.read_sql("SELECT cc_num, month, category, weight FROM monthly_weights", engine)
+    cpiu = pd.read_sql(
+        """
+        SELECT DATE(ym || '-01') AS month, cpi_index
+        FROM cpi_norm
+        WHERE category = 'Other'
+        ORDER BY ym
+        """,
+        engine,
+    )
+
+    personal["month"] = pd.to_datetime(personal["month"])
+    cpiu["month"] = pd.to_datetime(cpiu["month"])
+
+    clusters = spend_weight_clusters(weights)
+    cluster = clusters.loc[clusters["cc_num"] == cc_num, "cluster"]
+    if cluster.empty:
+        print(f"No cohort for cc_num={user_id}")
+        return
+    cohort = clusters.loc[clusters["cluster"] == cluster.iloc[0], "cc_num"].to_numpy()
+
+    payload = cohort_payload(personal, cohort, max_users=max_users)
+
+    # Split the gap-separated payload back into one segment per user for a LineCollection
+    x = date2num(pd.to_datetime(payload["x"]))
+    y = payload["y"]
+    breaks = np.flatnonzero(np.isnan(y))
+    segments = [
+        np.column_stack([x[a:b], y[a:b]])
+        for a, b in zip(np.r_[0, breaks[:-1] + 1], breaks)
+    ]
+
+    median = payload["median"]
+    cpiu = cpiu[(cpiu["month"] >= median["month"].min()) & (cpiu["month"] <= median["month"].max())]
+    user = personal[personal["cc_num"] == cc_num]
+
+    plt.figure(figsize=(12, 6))
+    ax = plt.gca()
+    ax.add_collection(LineCollection(segments, colors="steelblue", alpha=0.08, linewidths=0.8))
+    ax.plot(median["month"], median["personal_cpi"], label="Cohort median", linewidth=2)
+    ax.plot(cpiu["month"], cpiu["cpi_index"], label="Official CPI-U", linestyle="--", linewidth=2)
+    ax.plot(user["month"], user["personal_cpi"], label=f"User {user_id}", linewidth=2)
+    ax.autoscale_view()
+
+    plt.title(f"Spend-Weight Cohort of User {user_id} ({payload['n_users']} users) vs CPI-U")
+    plt.xlabel("Month")
+    plt.ylabel("Index (Base = 100)")
+    plt.grid(True, alpha=0.3)
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(f"charts/cohort_{user_id}.png", dpi=300)
+    plt.close()
+
+
 def generate_all_plots():
     
     mapping = get_user_mapping()
@@ -163,6 +230,7 @@ def generate_all_plots():
     plot_personal_vs_cpiu(cc_num, user_id)
     plot_category_weights(cc_num, user_id)
     plot_forecast(cc_num, user_id)
+    plot_cohort_overlay(cc_num, user_id)
 
     print("All plots saved in charts")
 